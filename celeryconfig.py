@@ -1,14 +1,34 @@
 # Celery Configuration for Certificate Generation
 # Author: devag7 (Dev Agarwalla)
 
+import os
+
 # Basic Celery configuration
-broker_url = 'redis://localhost:6379/0'
-result_backend = 'redis://localhost:6379/0'
+broker_url = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+result_backend = os.getenv('CELERY_RESULT_BACKEND', broker_url)
+
+# Broker connection settings
+worker_concurrency = int(os.getenv('CELERY_CONCURRENCY', os.cpu_count() or 1))
+# Bound the broker connection pool to the worker size, with headroom
+broker_pool_limit = worker_concurrency * 2
+broker_transport_options = {
+    # Must exceed the longest task runtime, or acks_late tasks get redelivered
+    'visibility_timeout': 3600,
+    'socket_keepalive': True,
+    'health_check_interval': 30,
+    'retry_on_timeout': True,
+}
+redis_socket_keepalive = True
 
 # Task settings
-task_serializer = 'json'
-result_serializer = 'json'
-accept_content = ['json']
+# msgpack is faster than json for small payloads and carries bytes natively;
+# json stays accepted so messages from older producers still decode.
+task_serializer = 'msgpack'
+result_serializer = 'msgpack'
+accept_content = ['msgpack', 'json']
+# PDF bytes returned as results cross Redis twice; zstd trims them cheaply
+task_compression = 'zstd'
+result_compression = 'zstd'
 timezone = 'UTC'
 enable_utc = True
 
@@ -16,4 +36,12 @@ enable_utc = True
 task_always_eager = False
 task_eager_propagates = True
 task_ignore_result = False
-task_store_eager_result = True
\ No newline at end of file
+task_store_eager_result = True
+
+# Worker settings
+# Reserve one task per process for fair dispatch: prefetched certificates would wait
+# behind a busy process while idle ones starve, and with acks_late every reserved
+# task stays unacknowledged in the worker's memory until it runs.
+worker_prefetch_multiplier = int(os.getenv('CELERY_PREFETCH_MULTIPLIER', '1'))
+# Acknowledge after completion so a crashed worker redelivers only its current task
+task_acks_late = True
@@ -12,12 +12,23 @@ Usage:
     # For custom data, modify cert_data dictionary below
 """
 
-from tasks import generate_certificate
+from celery import chord, group
+from tasks import CERTIFICATES_DIR, generate_certificate, summarize_batch
+from utils import ensure_directory
 import os
 import sys
 from pathlib import Path
 from datetime import datetime
 
+def save_certificate(result, certificate_id: str) -> Path:
+    """Write PDF bytes returned by the task locally; paths are returned as-is"""
+    if isinstance(result, bytes):
+        ensure_directory(CERTIFICATES_DIR)
+        certificate_path = CERTIFICATES_DIR / f"{certificate_id}.pdf"
+        certificate_path.write_bytes(result)
+        return certificate_path
+    return Path(result)
+
 def main():
     """Main function to generate certificates"""
     
@@ -48,16 +59,22 @@ def main():
         if async_mode:
             # Asynchronous processing with Celery (production mode)
             print("🔄 Starting asynchronous processing...")
-            result = generate_certificate.delay(cert_data)
+            wait_for_result = os.getenv('WAIT_FOR_RESULT', 'false').lower() == 'true'
+            
+            # Nobody collects the result of a fire-and-forget task, so the worker writes the PDF
+            result = generate_certificate.delay(cert_data, persist=None if wait_for_result else True)
             print(f"✅ Task queued successfully!")
             print(f"📋 Task ID: {result.id}")
             print(f"🔍 Monitor task status with: celery -A tasks inspect active")
             
             # Optional: Wait for result (with timeout)
-            if os.getenv('WAIT_FOR_RESULT', 'false').lower() == 'true':
+            if wait_for_result:
                 print("⏳ Waiting for result...")
                 try:
-                    certificate_path = result.get(timeout=300)  # 5 minute timeout
+                    certificate_path = save_certificate(
+                        result.get(timeout=300),  # 5 minute timeout
+                        cert_data['certificate_id']
+                    )
                     print(f"✅ Certificate generated successfully!")
                     print(f"📁 Location: {certificate_path}")
                     
@@ -71,10 +88,15 @@ def main():
                 except Exception as wait_error:
                     print(f"⚠️  Task timeout or error: {wait_error}")
                     print("💡 Certificate may still be processing. Check Celery worker logs.")
+            else:
+                print(f"📁 The worker will write it to: {CERTIFICATES_DIR}")
         else:
             # Synchronous processing (testing/debugging mode)
             print("🔄 Starting synchronous processing...")
-            certificate_path = generate_certificate(cert_data)
+            certificate_path = save_certificate(
+                generate_certificate(cert_data),
+                cert_data['certificate_id']
+            )
             print(f"✅ Certificate generated successfully!")
             print(f"📁 Location: {certificate_path}")
             
@@ -91,7 +113,6 @@ def main():
         print("💡 Troubleshooting tips:")
         print("   - Ensure all required dependencies are installed")
         print("   - Check if template and font files exist")
-        print("   - Verify FFmpeg and ImageMagick are installed")
         print("   - For async mode, ensure Redis/Celery broker is running")
         sys.exit(1)
 
@@ -125,17 +146,28 @@ def batch_generate():
         }
     ]
     
-    tasks = []
-    for data in batch_data:
-        try:
-            task = generate_certificate.delay(data)
-            tasks.append((task, data['user_name']))
-            print(f"✅ Queued: {data['user_name']} - Task ID: {task.id}")
-        except Exception as e:
-            print(f"❌ Failed to queue {data['user_name']}: {e}")
+    # Submit the whole batch in a single broker round-trip; workers write the PDFs
+    # and return paths, so no PDF bytes travel back through the result backend
+    signatures = [generate_certificate.s(data, persist=True) for data in batch_data]
     
-    print(f"\n🎯 Batch processing started: {len(tasks)} certificates queued")
-    print("📋 Monitor progress with: celery -A tasks inspect active")
+    try:
+        if os.getenv('WAIT_FOR_RESULT', 'false').lower() == 'true':
+            # Chord: summarize_batch runs once every certificate is done
+            job = chord(signatures)(summarize_batch.s())
+            print(f"✅ Batch queued: {len(signatures)} certificates - Chord ID: {job.id}")
+            print("⏳ Waiting for batch result...")
+            summary = job.get(timeout=300)
+            print(f"✅ Generated {summary['certificates_generated']} certificates "
+                  f"({summary['total_size_mb']:.2f} MB)")
+        else:
+            job = group(signatures).apply_async()
+            for task, data in zip(job.results, batch_data):
+                print(f"✅ Queued: {data['user_name']} - Task ID: {task.id}")
+            print(f"\n🎯 Batch processing started: {len(job.results)} certificates queued")
+            print(f"📋 Group ID: {job.id}")
+            print("📋 Monitor progress with: celery -A tasks inspect active")
+    except Exception as e:
+        print(f"❌ Failed to process batch: {e}")
 
 if __name__ == "__main__":
     # Check command line arguments
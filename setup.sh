@@ -15,26 +15,6 @@ else
     exit 1
 fi
 
-# Check if FFmpeg is available
-if command -v ffmpeg &> /dev/null; then
-    echo "✅ FFmpeg found"
-else
-    echo "❌ FFmpeg not found. Please install FFmpeg"
-    echo "   macOS: brew install ffmpeg"
-    echo "   Ubuntu: sudo apt install ffmpeg"
-    exit 1
-fi
-
-# Check if ImageMagick is available
-if command -v convert &> /dev/null || command -v magick &> /dev/null; then
-    echo "✅ ImageMagick found"
-else
-    echo "❌ ImageMagick not found. Please install ImageMagick"
-    echo "   macOS: brew install imagemagick"
-    echo "   Ubuntu: sudo apt install imagemagick"
-    exit 1
-fi
-
 # Create virtual environment if it doesn't exist
 if [ ! -d "venv" ]; then
     echo "🔧 Creating virtual environment..."
@@ -47,10 +27,20 @@ source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Optionally compile utils.py to a C extension with mypyc (COMPILE_UTILS=1 ./setup.sh)
+if [ "$COMPILE_UTILS" = "1" ]; then
+    echo "⚙️  Compiling utils.py with mypyc..."
+    pip install mypy
+    mypyc utils.py
+fi
+
 # Create necessary directories
 mkdir -p certificates
 mkdir -p temp
 
+# Pre-decode the certificate template for fast worker startup
+python -c "import tasks; tasks.build_template_cache()"
+
 echo
 echo "🎉 Setup complete!"
 echo "✅ All dependencies installed"
@@ -3,44 +3,85 @@ Certificate Generation Task Module
 ==================================
 
 Author: devag7 (Deva Garwalla)
-Description: Advanced certificate generation system using Celery, FFmpeg, and ReportLab.
+Description: Advanced certificate generation system using Celery and Pillow.
              Supports dynamic content, QR codes, and optimized PDF generation.
 
 Features:
 - Dynamic text overlays with custom fonts
 - QR code generation and embedding
-- Multiple output formats (PDF, PNG, JPG)
+- In-process rendering and PDF output, no external binaries
 - Optimized file sizes for production use
 - Error handling and recovery mechanisms
 - Background processing with Celery
 """
 
+import io
 import os
-import subprocess
 import logging
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Any
+from typing import Annotated, Dict, Any, List, Optional, Union
+import msgspec
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont
 from celery import Celery
-from utils import generate_qr_code, format_datetime
+from celery.signals import worker_process_init
+from utils import (
+    ensure_directory, format_datetime, generate_qr_matrix, get_file_size_mb, parse_iso_datetime
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Celery configuration
-app = Celery('certificate_generator', broker='pyamqp://localhost//')
+# Celery configuration (broker, serializers, worker tuning) lives in celeryconfig.py
+app = Celery('certificate_generator')
+app.config_from_object('celeryconfig')
 
 # Base configuration
 BASE_DIR = Path(__file__).parent.resolve()
 FONT_PATH = BASE_DIR / "fonts" / "Open Sans Bold.ttf"
 TEMPLATE_PATH = BASE_DIR / "templates" / "certificate_template.jpg"
+TEMPLATE_CACHE_PATH = TEMPLATE_PATH.with_suffix(".npy")
 CERTIFICATES_DIR = BASE_DIR / "certificates"
 TEMP_DIR = BASE_DIR / "temp"
 
+# Write PDFs to CERTIFICATES_DIR and return the path instead of the PDF bytes
+PERSIST_TO_DISK = os.getenv('PERSIST_TO_DISK') == '1'
+
+# Width in pixels of the rendered certificate; the template is scaled to it
+# once when decoded, so text is drawn directly at the final resolution
+OUTPUT_WIDTH = 1500
+
+# Text overlays as (text, position, font size, colour), in output pixels; text
+# placeholders are filled from the certificate data plus the formatted issue date
+TEXT_LAYOUT = (
+    ("{user_name}", (68, 660), 38, "black"),
+    ("{college}", (68, 821), 34, "black"),
+    ("{topic}", (68, 964), 30, "black"),
+    ("{certificate_id}", (1271, 82), 15, "darkred"),
+    ("Date: {date}", (1238, 101), 19, "black"),
+    ("Generated by devag7", (38, 38), 9, "gray"),
+)
+FONT_SIZES = tuple(size for _, _, size, _ in TEXT_LAYOUT)
+PRELOAD_GLYPHS = "".join(chr(c) for c in range(32, 127))
+
+# QR code placement: top-left corner and side of the square the code is centred in, in output pixels
+QR_POSITION = (1252, 480)
+QR_SIZE = 180
+
 # Required fields for certificate generation
 REQUIRED_KEYS = ['user_name', 'college', 'certificate_id', 'issued_at', 'topic']
 
+class CertificateData(msgspec.Struct):
+    """Schema for certificate fields with type or length constraints"""
+    user_name: Annotated[str, msgspec.Meta(max_length=100)]
+    college: Annotated[str, msgspec.Meta(max_length=200)]
+    topic: Annotated[str, msgspec.Meta(max_length=150)]
+    issued_at: str
+
 class CertificateGenerationError(Exception):
     """Custom exception for certificate generation errors"""
     pass
@@ -51,19 +92,12 @@ def validate_data(data: Dict[str, Any]) -> Dict[str, Any]:
     if missing:
         raise ValueError(f"Missing or empty required fields: {', '.join(missing)}")
     
-    # Validate data types and lengths
-    if not isinstance(data['user_name'], str) or len(data['user_name']) > 100:
-        raise ValueError("user_name must be a string with max 100 characters")
-    
-    if not isinstance(data['college'], str) or len(data['college']) > 200:
-        raise ValueError("college must be a string with max 200 characters")
+    # Validate data types and lengths (msgspec.ValidationError is a ValueError)
+    msgspec.convert(data, CertificateData)
     
-    if not isinstance(data['topic'], str) or len(data['topic']) > 150:
-        raise ValueError("topic must be a string with max 150 characters")
-        
     # Validate date format
     try:
-        datetime.fromisoformat(data['issued_at'])
+        parse_iso_datetime(data['issued_at'])
     except ValueError:
         raise ValueError("issued_at must be in ISO format")
     
@@ -72,33 +106,104 @@ def validate_data(data: Dict[str, Any]) -> Dict[str, Any]:
 def ensure_directories():
     """Ensure required directories exist"""
     for directory in [CERTIFICATES_DIR, TEMP_DIR]:
-        directory.mkdir(exist_ok=True)
+        ensure_directory(directory)
+
+def decode_template() -> np.ndarray:
+    """Decode the template to RGB pixels, scaled to the output width"""
+    with Image.open(TEMPLATE_PATH) as template:
+        height = round(template.height * OUTPUT_WIDTH / template.width)
+        return np.asarray(template.convert("RGB").resize((OUTPUT_WIDTH, height), Image.LANCZOS))
+
+def build_template_cache() -> Path:
+    """Decode the template once and store its raw RGB pixels next to it"""
+    pixels = decode_template()
+    
+    # Write atomically so concurrent workers never map a partial file
+    tmp_path = TEMPLATE_CACHE_PATH.with_name(f"{TEMPLATE_CACHE_PATH.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, pixels)
+    os.replace(tmp_path, TEMPLATE_CACHE_PATH)
+    return TEMPLATE_CACHE_PATH
+
+@lru_cache(maxsize=1)
+def load_template() -> np.ndarray:
+    """Memory-map the pre-decoded template pixels, rebuilding the cache if stale"""
+    try:
+        if (not TEMPLATE_CACHE_PATH.exists()
+                or TEMPLATE_CACHE_PATH.stat().st_mtime < TEMPLATE_PATH.stat().st_mtime):
+            build_template_cache()
+        pixels = np.load(TEMPLATE_CACHE_PATH, mmap_mode="r")
+        if pixels.shape[1] != OUTPUT_WIDTH:
+            build_template_cache()
+            pixels = np.load(TEMPLATE_CACHE_PATH, mmap_mode="r")
+        return pixels
+    except OSError as e:
+        logger.warning(f"Template cache unavailable ({e}), decoding template in memory")
+        return decode_template()
+
+@lru_cache(maxsize=None)
+def load_font(size: int) -> ImageFont.FreeTypeFont:
+    """Load the certificate font at the given size, cached per process"""
+    if FONT_PATH.exists():
+        font = ImageFont.truetype(str(FONT_PATH), size)
+    else:
+        font = ImageFont.load_default(size)
+    
+    # Lay out every printable ASCII glyph so FreeType loads them up front
+    font.getbbox(PRELOAD_GLYPHS)
+    return font
 
-def text_escape(text: str) -> str:
-    """Escape special characters for FFmpeg text filters"""
-    return (
-        str(text)
-        .replace("\\", "\\\\")
-        .replace(":", "\\:")
-        .replace("'", r"\'")
-        .replace('"', r'\"')
-        .replace("[", r"\[")
-        .replace("]", r"\]")
-        .replace(",", r"\,")
-        .replace(";", r"\;")
-    )
+@worker_process_init.connect
+def warm_caches(**kwargs) -> None:
+    """Load the template and fonts in each worker child before its first task"""
+    try:
+        load_template()
+        for size in FONT_SIZES:
+            load_font(size)
+    except OSError as e:
+        logger.warning(f"Could not warm render caches: {e}")
+
+def blit_qr_code(pixels: np.ndarray, qr_matrix: np.ndarray) -> None:
+    """Stamp the dark QR modules onto an RGB pixel buffer in place"""
+    # Whole pixels per module, so every module comes out the same size for scanners
+    scale = QR_SIZE // len(qr_matrix)
+    if scale == 0:
+        raise CertificateGenerationError(
+            f"QR code of {len(qr_matrix)} modules does not fit in {QR_SIZE} pixels"
+        )
+    mask = np.repeat(np.repeat(qr_matrix, scale, axis=0), scale, axis=1)
+    
+    # Centre the scaled code in the QR_SIZE square
+    x0, y0 = (coord + (QR_SIZE - len(mask)) // 2 for coord in QR_POSITION)
+    pixels[y0:y0 + len(mask), x0:x0 + len(mask)][mask] = 0
+
+def write_certificate(certificate_id: str, pdf_bytes: bytes) -> Path:
+    """Write a rendered PDF to CERTIFICATES_DIR and return its path"""
+    pdf_output_path = CERTIFICATES_DIR / f"{certificate_id}.pdf"
+    ensure_directory(CERTIFICATES_DIR)
+    
+    try:
+        pdf_output_path.write_bytes(pdf_bytes)
+    except FileNotFoundError:
+        # Removed since ensure_directory cached it; recreate it instead of failing every retry
+        ensure_directory(CERTIFICATES_DIR, refresh=True)
+        pdf_output_path.write_bytes(pdf_bytes)
+    
+    return pdf_output_path
 
 @app.task(bind=True, max_retries=3)
-def generate_certificate(self, data: Dict[str, Any]) -> str:
+def generate_certificate(self, data: Dict[str, Any], persist: Optional[bool] = None) -> Union[bytes, str]:
     """
     Main task for generating certificates
     
     Args:
         data: Dictionary containing certificate information
             Required keys: user_name, college, certificate_id, issued_at, topic
+        persist: Write the PDF to CERTIFICATES_DIR instead of returning it
+            (defaults to PERSIST_TO_DISK)
             
     Returns:
-        Path to generated certificate PDF
+        PDF bytes, or the path to the written PDF when persisting
         
     Raises:
         CertificateGenerationError: If generation fails
@@ -109,114 +214,47 @@ def generate_certificate(self, data: Dict[str, Any]) -> str:
         # Validate input data
         data = validate_data(data)
         
-        # Ensure directories exist
-        ensure_directories()
-        
         # Check if template exists
         if not TEMPLATE_PATH.exists():
             raise FileNotFoundError(f"Template not found: {TEMPLATE_PATH}")
         if not FONT_PATH.exists():
             logger.warning(f"Font not found: {FONT_PATH}, using system default")
         
-        # Generate QR code
-        qr_path = generate_qr_code(data['certificate_id'])
+        # Stamp the QR code onto a copy of the pre-decoded template
+        pixels = np.array(load_template())
+        blit_qr_code(pixels, generate_qr_matrix(data['certificate_id']))
         
-        # Prepare escaped text
-        esc = {
-            'name': text_escape(data['user_name']),
-            'college': text_escape(data['college']),
-            'topic': text_escape(data['topic']),
-            'cid': text_escape(data['certificate_id']),
-            'date': text_escape(format_datetime(data['issued_at'])),
-        }
-        
-        # Build filter chain with developer credit
-        font_file = str(FONT_PATH).replace(" ", "\\ ")
-        
-        filter_chain = (
-            f"drawtext=text='{esc['name']}':x=90:y=880:fontsize=50:"
-            f"fontcolor=black:fontfile='{font_file}',"
-            f"drawtext=text='{esc['college']}':x=90:y=1095:fontsize=45:"
-            f"fontcolor=black:fontfile='{font_file}',"
-            f"drawtext=text='{esc['topic']}':x=90:y=1285:fontsize=40:"
-            f"fontcolor=black:fontfile='{font_file}',"
-            f"drawtext=text='{esc['cid']}':x=1695:y=110:"
-            f"fontsize=20:fontcolor=darkred:fontfile='{font_file}',"
-            f"drawtext=text='Date\\: {esc['date']}':x=1650:y=135:"
-            f"fontsize=25:fontcolor=black:fontfile='{font_file}',"
-            f"drawtext=text='Generated by devag7':x=50:y=50:fontsize=12:"
-            f"fontcolor=gray:fontfile='{font_file}'"
-        )
+        # Draw text overlays
+        img = Image.fromarray(pixels)
+        draw = ImageDraw.Draw(img)
         
-        # Generate high-quality intermediate image
-        temp_img_path = TEMP_DIR / f"{data['certificate_id']}_temp.jpg"
+        fields = dict(data, date=format_datetime(data['issued_at']))
+        for text, position, size, fill in TEXT_LAYOUT:
+            draw.text(position, text.format_map(fields), font=load_font(size), fill=fill)
         
-        ffmpeg_cmd = [
-            'ffmpeg', '-y',
-            '-i', str(TEMPLATE_PATH),
-            '-vf', f"{filter_chain},scale=1500:-1",
-            '-q:v', '2',
-            str(temp_img_path)
-        ]
+        # Encode the PDF in memory, no intermediate image or external converter
+        buf = io.BytesIO()
         
         try:
-            result = subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-            logger.info("FFmpeg image generation successful")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFmpeg failed: {e.stderr}")
-            raise CertificateGenerationError(f"Image generation failed: {e.stderr}")
+            img.save(buf, "PDF", resolution=200.0, quality=85, optimize=True)
+            logger.info("PDF generation successful")
+        except OSError as e:
+            logger.error(f"PDF generation failed: {e}")
+            raise CertificateGenerationError(f"PDF generation failed: {e}")
         
-        # Convert to PDF with optimization
-        pdf_output_path = CERTIFICATES_DIR / f"{data['certificate_id']}.pdf"
+        pdf_bytes = buf.getvalue()
         
-        # Try multiple conversion methods for best results
-        conversion_success = False
-        
-        # Method 1: ImageMagick (best quality)
-        try:
-            img_to_pdf_cmd = [
-                'convert', str(temp_img_path),
-                '-density', '200',
-                '-quality', '85',
-                '-compress', 'jpeg',
-                str(pdf_output_path)
-            ]
-            subprocess.run(img_to_pdf_cmd, check=True)
-            conversion_success = True
-            logger.info("PDF conversion successful using ImageMagick")
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            logger.warning("ImageMagick conversion failed, trying FFmpeg")
+        # Verify file size
+        size_mb = len(pdf_bytes) / (1024 * 1024)
+        logger.info(f"Certificate generated successfully. Size: {size_mb:.2f} MB")
         
-        # Method 2: FFmpeg direct conversion
-        if not conversion_success:
-            try:
-                ffmpeg_pdf_cmd = [
-                    'ffmpeg', '-y',
-                    '-i', str(temp_img_path),
-                    '-f', 'pdf',
-                    str(pdf_output_path)
-                ]
-                subprocess.run(ffmpeg_pdf_cmd, check=True)
-                conversion_success = True
-                logger.info("PDF conversion successful using FFmpeg")
-            except subprocess.CalledProcessError:
-                raise CertificateGenerationError("All PDF conversion methods failed")
+        if size_mb > 3:
+            logger.warning(f"File size ({size_mb:.2f} MB) exceeds 3MB limit")
         
-        # Cleanup
-        if temp_img_path.exists():
-            temp_img_path.unlink()
-        if qr_path.exists():
-            qr_path.unlink()
+        if PERSIST_TO_DISK if persist is None else persist:
+            return str(write_certificate(data['certificate_id'], pdf_bytes))
         
-        # Verify file size
-        if pdf_output_path.exists():
-            size_mb = pdf_output_path.stat().st_size / (1024 * 1024)
-            logger.info(f"Certificate generated successfully. Size: {size_mb:.2f} MB")
-            
-            if size_mb > 3:
-                logger.warning(f"File size ({size_mb:.2f} MB) exceeds 3MB limit")
-        
-        return str(pdf_output_path)
+        return pdf_bytes
             
     except Exception as e:
         logger.error(f"Certificate generation failed: {str(e)}")
@@ -228,6 +266,26 @@ def generate_certificate(self, data: Dict[str, Any]) -> str:
         
         raise CertificateGenerationError(f"Failed to generate certificate after {self.max_retries} attempts: {str(e)}")
 
+@app.task
+def summarize_batch(results: List[str]) -> Dict[str, Any]:
+    """
+    Chord callback summarizing a batch of generated certificates
+    
+    Args:
+        results: Paths returned by the batch's generate_certificate tasks, run with
+            persist=True so the PDFs do not travel through the broker
+        
+    Returns:
+        Dictionary with batch statistics
+    """
+    total_size_mb = sum(get_file_size_mb(result) for result in results)
+    logger.info(f"Batch completed: {len(results)} certificates, {total_size_mb:.2f} MB")
+    
+    return {
+        'certificates_generated': len(results),
+        'total_size_mb': round(total_size_mb, 2)
+    }
+
 @app.task
 def cleanup_old_certificates(days_old: int = 30) -> Dict[str, int]:
     """
@@ -241,23 +299,38 @@ def cleanup_old_certificates(days_old: int = 30) -> Dict[str, int]:
     """
     from datetime import timedelta
     
-    cutoff_date = datetime.now() - timedelta(days=days_old)
+    cutoff_time = (datetime.now() - timedelta(days=days_old)).timestamp()
+    victims = []
     cleaned_count = 0
     total_size_mb = 0
     
-    for cert_file in CERTIFICATES_DIR.glob("*.pdf"):
-        file_time = datetime.fromtimestamp(cert_file.stat().st_mtime)
-        if file_time < cutoff_date:
-            size_mb = cert_file.stat().st_size / (1024 * 1024)
-            cert_file.unlink()
-            cleaned_count += 1
-            total_size_mb += size_mb
+    # scandir entries carry one stat result each, so mtime and size share a syscall
+    if CERTIFICATES_DIR.exists():
+        with os.scandir(CERTIFICATES_DIR) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".pdf"):
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime < cutoff_time:
+                    victims.append((entry.path, stat.st_size))
     
     # Clean temp directory
-    for temp_file in TEMP_DIR.glob("*"):
-        file_time = datetime.fromtimestamp(temp_file.stat().st_mtime)
-        if file_time < cutoff_date:
-            temp_file.unlink()
+    if TEMP_DIR.exists():
+        with os.scandir(TEMP_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff_time:
+                    victims.append((entry.path, None))
+    
+    for path, size in victims:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue  # Already removed by another cleanup run or by hand
+        
+        # Only certificates count towards the statistics
+        if size is not None:
+            cleaned_count += 1
+            total_size_mb += size / (1024 * 1024)
     
     logger.info(f"Cleanup completed: {cleaned_count} files removed, {total_size_mb:.2f} MB freed")
     
@@ -279,8 +352,7 @@ def health_check() -> Dict[str, Any]:
         'template_exists': TEMPLATE_PATH.exists(),
         'font_exists': FONT_PATH.exists(),
         'directories_writable': True,
-        'ffmpeg_available': False,
-        'imagemagick_available': False
+        'pillow_version': PIL.__version__
     }
     
     # Check directory permissions
@@ -291,20 +363,6 @@ def health_check() -> Dict[str, Any]:
     except Exception:
         status['directories_writable'] = False
     
-    # Check FFmpeg availability
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        status['ffmpeg_available'] = True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
-    
-    # Check ImageMagick availability
-    try:
-        subprocess.run(['convert', '-version'], capture_output=True, check=True)
-        status['imagemagick_available'] = True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
-    
     return status
 
 if __name__ == "__main__":
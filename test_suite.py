@@ -11,21 +11,40 @@ import os
 import tempfile
 import shutil
 from datetime import datetime
+from functools import cached_property
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
+import numpy as np
+from PIL import Image
 
 # Import modules to test
 import tasks
 import utils
 
 
-class TestUtils(unittest.TestCase):
-    """Test utility functions"""
+class TempDirTestCase(unittest.TestCase):
+    """Base class sharing one temporary directory across a test class"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Create the class-wide temporary directory"""
+        cls._tmp = tempfile.mkdtemp()
     
-    def setUp(self):
-        """Set up test fixtures"""
-        self.temp_dir = tempfile.mkdtemp()
-        self.addCleanup(shutil.rmtree, self.temp_dir)
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the class-wide temporary directory"""
+        shutil.rmtree(cls._tmp)
+    
+    @cached_property
+    def temp_dir(self):
+        """Per-test directory, only created by tests that use it"""
+        path = os.path.join(self._tmp, self._testMethodName)
+        os.mkdir(path)
+        return path
+
+
+class TestUtils(TempDirTestCase):
+    """Test utility functions"""
     
     def test_generate_qr_code(self):
         """Test QR code generation"""
@@ -36,6 +55,43 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(qr_path.name.endswith('.png'))
         self.assertIn(cert_id, qr_path.name)
     
+    def test_generate_qr_code_ecc(self):
+        """Test QR error correction level and module size are configurable"""
+        high = utils.generate_qr_code("TEST-QR-H", Path(self.temp_dir) / "h", ecc="H", box_size=10)
+        medium = utils.generate_qr_code("TEST-QR-M", Path(self.temp_dir) / "m", ecc="M", box_size=10)
+        
+        with Image.open(high) as high_img, Image.open(medium) as medium_img:
+            self.assertEqual(medium_img.width % 10, 0)
+            self.assertLess(medium_img.width, high_img.width)
+    
+    def test_generate_qr_matrix(self):
+        """Test the QR module matrix matches the rendered QR image"""
+        qr_path = utils.generate_qr_code("TEST-QR-123", self.temp_dir, box_size=1)
+        qr_matrix = utils.generate_qr_matrix("TEST-QR-123")
+        
+        with Image.open(qr_path) as qr_img:
+            dark = np.asarray(qr_img.convert("L")) < 128
+        self.assertTrue((qr_matrix == dark).all())
+    
+    def test_generate_qr_codes_batch(self):
+        """Test parallel QR code generation keeps input order"""
+        cert_ids = [f"TEST-BATCH-{i:03d}" for i in range(4)]
+        qr_paths = utils.generate_qr_codes_batch(cert_ids, self.temp_dir, max_workers=2)
+        
+        self.assertEqual([p.name for p in qr_paths], [f"{c}_qr.png" for c in cert_ids])
+        self.assertTrue(all(p.exists() for p in qr_paths))
+    
+    def test_ensure_directory_cached(self):
+        """Test directories are only created once per process"""
+        target = Path(self.temp_dir) / "nested" / "dir"
+        
+        utils.ensure_directory(target)
+        self.assertTrue(target.is_dir())
+        
+        with patch.object(Path, 'mkdir') as mock_mkdir:
+            utils.ensure_directory(target)
+        mock_mkdir.assert_not_called()
+    
     def test_format_datetime(self):
         """Test datetime formatting"""
         iso_string = "2025-06-10T14:30:00+00:00"
@@ -44,6 +100,7 @@ class TestUtils(unittest.TestCase):
         self.assertIsInstance(formatted, str)
         self.assertIn("Jun", formatted)
         self.assertIn("2025", formatted)
+        self.assertEqual(formatted, "10-Jun-2025 14:30")
     
     def test_format_datetime_invalid(self):
         """Test datetime formatting with invalid input"""
@@ -52,13 +109,25 @@ class TestUtils(unittest.TestCase):
         
         self.assertEqual(formatted, "Invalid Date")
     
+    def test_parse_iso_datetime_cached(self):
+        """Test ISO parsing is memoized for repeated timestamps"""
+        iso_string = "2025-06-10T14:30:00+00:00"
+        parsed = utils.parse_iso_datetime(iso_string)
+        
+        self.assertEqual(parsed, datetime.fromisoformat(iso_string))
+        self.assertIs(utils.parse_iso_datetime(iso_string), parsed)
+        
+        with self.assertRaises(ValueError):
+            utils.parse_iso_datetime("invalid-date")
+    
     def test_validate_certificate_id(self):
         """Test certificate ID validation"""
         # Valid IDs
         valid_ids = [
             "CERT-123456789",
             "TEST-ABCD-2025",
-            "CSI_CERT_001"
+            "CSI_CERT_001",
+            "cert-lower-001"
         ]
         
         for cert_id in valid_ids:
@@ -88,18 +157,32 @@ class TestUtils(unittest.TestCase):
         non_existent = Path(self.temp_dir) / "nonexistent.txt"
         size_mb = utils.get_file_size_mb(non_existent)
         self.assertEqual(size_mb, 0.0)
+    
+    def test_cleanup_temp_files(self):
+        """Test only temp files older than the cutoff are removed"""
+        old_file = Path(self.temp_dir) / "old.png"
+        old_file.touch()
+        old_time = datetime.now().timestamp() - 48 * 3600
+        os.utime(old_file, (old_time, old_time))
+        new_file = Path(self.temp_dir) / "new.png"
+        new_file.touch()
+        
+        utils.cleanup_temp_files(self.temp_dir, max_age_hours=24)
+        
+        self.assertFalse(old_file.exists())
+        self.assertTrue(new_file.exists())
 
 
-class TestTasks(unittest.TestCase):
+class TestTasks(TempDirTestCase):
     """Test certificate generation tasks"""
     
-    def setUp(self):
-        """Set up test fixtures"""
-        self.temp_dir = tempfile.mkdtemp()
-        self.addCleanup(shutil.rmtree, self.temp_dir)
+    @classmethod
+    def setUpClass(cls):
+        """Set up fixtures shared by every test in the class"""
+        super().setUpClass()
         
-        # Valid test data
-        self.valid_data = {
+        # Valid test data (tests copy it before mutating)
+        cls.valid_data = {
             "user_name": "Test User",
             "college": "Test University",
             "certificate_id": f"TEST-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
@@ -107,6 +190,10 @@ class TestTasks(unittest.TestCase):
             "topic": "Test Topic"
         }
     
+    def _output_dirs(self):
+        """Keyword arguments pointing the task output directories at temp_dir"""
+        return {'CERTIFICATES_DIR': Path(self.temp_dir), 'TEMP_DIR': Path(self.temp_dir)}
+    
     def test_validate_data_valid(self):
         """Test data validation with valid data"""
         validated = tasks.validate_data(self.valid_data)
@@ -132,7 +219,7 @@ class TestTasks(unittest.TestCase):
         with self.assertRaises(ValueError) as context:
             tasks.validate_data(invalid_data)
         
-        self.assertIn("user_name must be a string", str(context.exception))
+        self.assertIn("Expected `str`, got `int` - at `$.user_name`", str(context.exception))
     
     def test_validate_data_field_length(self):
         """Test data validation with field length limits"""
@@ -142,64 +229,155 @@ class TestTasks(unittest.TestCase):
         with self.assertRaises(ValueError) as context:
             tasks.validate_data(invalid_data)
         
-        self.assertIn("max 100 characters", str(context.exception))
-    
-    def test_text_escape(self):
-        """Test text escaping for FFmpeg"""
-        test_cases = [
-            ("Hello World", "Hello World"),
-            ("John's Certificate", "John\\'s Certificate"),
-            ("Data: Analysis", "Data\\: Analysis"),
-            ("Test [123]", "Test \\[123\\]"),
-            ("A, B; C", "A\\, B\\; C"),
-        ]
-        
-        for input_text, expected in test_cases:
-            result = tasks.text_escape(input_text)
-            self.assertEqual(result, expected)
+        self.assertIn("length <= 100 - at `$.user_name`", str(context.exception))
     
     def test_ensure_directories(self):
         """Test directory creation"""
         # Mock the directory paths
-        with patch('tasks.CERTIFICATES_DIR', Path(self.temp_dir) / "certs"), \
-             patch('tasks.TEMP_DIR', Path(self.temp_dir) / "temp"):
+        with patch.multiple('tasks', CERTIFICATES_DIR=Path(self.temp_dir) / "certs",
+                            TEMP_DIR=Path(self.temp_dir) / "temp"):
             
             tasks.ensure_directories()
             
             self.assertTrue((Path(self.temp_dir) / "certs").exists())
             self.assertTrue((Path(self.temp_dir) / "temp").exists())
     
-    @patch('tasks.subprocess.run')
-    @patch('tasks.generate_qr_code')
-    @patch('tasks.TEMPLATE_PATH')
-    @patch('tasks.FONT_PATH')
-    def test_generate_certificate_success(self, mock_font_path, mock_template_path, 
-                                        mock_qr_code, mock_subprocess):
+    def test_build_template_cache(self):
+        """Test the pre-decoded template cache matches the template image"""
+        cache_path = Path(self.temp_dir) / "template.npy"
+        
+        with patch('tasks.TEMPLATE_CACHE_PATH', cache_path):
+            tasks.build_template_cache()
+        
+        pixels = np.load(cache_path, mmap_mode="r")
+        with Image.open(tasks.TEMPLATE_PATH) as template:
+            height = round(template.height * tasks.OUTPUT_WIDTH / template.width)
+        self.assertEqual(pixels.shape, (height, tasks.OUTPUT_WIDTH, 3))
+    
+    def test_warm_caches(self):
+        """Test worker warm-up populates the template and font caches"""
+        tasks.warm_caches()
+        
+        self.assertEqual(tasks.load_template.cache_info().currsize, 1)
+        self.assertGreaterEqual(tasks.load_font.cache_info().currsize, len(tasks.FONT_SIZES))
+    
+    def test_blit_qr_code(self):
+        """Test QR modules are stamped only inside the QR region"""
+        qr_matrix = utils.generate_qr_matrix("TEST-BLIT-001")
+        pixels = np.full((1060, 1500, 3), 255, dtype=np.uint8)
+        
+        tasks.blit_qr_code(pixels, qr_matrix)
+        
+        x0, y0 = tasks.QR_POSITION
+        region = pixels[y0:y0 + tasks.QR_SIZE, x0:x0 + tasks.QR_SIZE]
+        self.assertTrue((region == 0).any())
+        self.assertEqual(int((pixels == 0).sum()), int((region == 0).sum()))
+        
+        # Every dark module is stamped as an equal, whole-pixel square
+        scale = tasks.QR_SIZE // len(qr_matrix)
+        self.assertEqual(int((pixels == 0).sum()), int(qr_matrix.sum()) * scale * scale * 3)
+    
+    def test_blit_qr_code_too_large(self):
+        """Test a QR matrix larger than QR_SIZE is rejected instead of sampled down"""
+        pixels = np.full((1060, 1500, 3), 255, dtype=np.uint8)
+        qr_matrix = np.ones((tasks.QR_SIZE + 1, tasks.QR_SIZE + 1), dtype=bool)
+        
+        with self.assertRaises(tasks.CertificateGenerationError):
+            tasks.blit_qr_code(pixels, qr_matrix)
+    
+    def test_generate_certificate_success(self):
         """Test successful certificate generation"""
-        # Setup mocks
-        mock_template_path.exists.return_value = True
-        mock_font_path.exists.return_value = True
-        mock_qr_code.return_value = Path(self.temp_dir) / "qr.png"
-        mock_subprocess.return_value = MagicMock(returncode=0)
-        
-        # Mock the output path
-        with patch('tasks.CERTIFICATES_DIR', Path(self.temp_dir)):
-            # Create mock files
-            (Path(self.temp_dir) / f"{self.valid_data['certificate_id']}.pdf").touch()
+        with patch.multiple('tasks', **self._output_dirs()):
+            result = tasks.generate_certificate(self.valid_data)
+        
+        self.assertIsInstance(result, bytes)
+        self.assertTrue(result.startswith(b'%PDF'))
+        self.assertFalse(list(Path(self.temp_dir).glob("*.pdf")))
+    
+    def test_generate_certificate_persist_to_disk(self):
+        """Test certificate generation writes the PDF when persisting to disk"""
+        with patch.multiple('tasks', PERSIST_TO_DISK=True, **self._output_dirs()):
+            result = tasks.generate_certificate(self.valid_data)
+        
+        self.assertTrue(result.endswith('.pdf'))
+        self.assertTrue(Path(result).read_bytes().startswith(b'%PDF'))
+    
+    def test_generate_certificate_persist_argument(self):
+        """Test the persist argument overrides PERSIST_TO_DISK"""
+        with patch.multiple('tasks', PERSIST_TO_DISK=False, **self._output_dirs()):
+            result = tasks.generate_certificate(self.valid_data, persist=True)
+        
+        self.assertTrue(Path(result).read_bytes().startswith(b'%PDF'))
+    
+    def test_write_certificate_recreates_directory(self):
+        """Test a certificates directory removed after it was ensured is recreated"""
+        certs_dir = Path(self.temp_dir) / "certs"
+        with patch.multiple('tasks', CERTIFICATES_DIR=certs_dir):
+            tasks.write_certificate("TEST-WRITE-001", b"%PDF-first")
+            shutil.rmtree(certs_dir)
             
-            # This would normally be called as a Celery task, but we'll call directly
-            # result = tasks.generate_certificate(self.valid_data)
-            # self.assertTrue(result.endswith('.pdf'))
+            pdf_path = tasks.write_certificate("TEST-WRITE-001", b"%PDF-second")
+        
+        self.assertEqual(pdf_path.read_bytes(), b"%PDF-second")
+    
+    def test_summarize_batch(self):
+        """Test batch summary statistics"""
+        cert_files = [Path(self.temp_dir) / "cert-1.pdf", Path(self.temp_dir) / "cert-2.pdf"]
+        for cert_file in cert_files:
+            cert_file.write_bytes(b"x" * 1024 * 1024)
+        
+        summary = tasks.summarize_batch([str(cert_file) for cert_file in cert_files])
+        
+        self.assertEqual(summary['certificates_generated'], 2)
+        self.assertAlmostEqual(summary['total_size_mb'], 2.0)
+    
+    def test_cleanup_old_certificates(self):
+        """Test only certificates older than the cutoff are removed"""
+        certs_dir = Path(self.temp_dir) / "certs"
+        certs_dir.mkdir()
+        old_cert = certs_dir / "old.pdf"
+        old_cert.write_bytes(b"x" * 1024 * 1024)
+        old_time = datetime.now().timestamp() - 40 * 86400
+        os.utime(old_cert, (old_time, old_time))
+        new_cert = certs_dir / "new.pdf"
+        new_cert.touch()
+        
+        with patch.multiple('tasks', CERTIFICATES_DIR=certs_dir,
+                            TEMP_DIR=Path(self.temp_dir) / "missing"):
+            stats = tasks.cleanup_old_certificates(days_old=30)
+        
+        self.assertEqual(stats, {'files_removed': 1, 'space_freed_mb': 1.0})
+        self.assertFalse(old_cert.exists())
+        self.assertTrue(new_cert.exists())
+    
+    def test_cleanup_old_certificates_already_removed(self):
+        """Test a certificate deleted after the scan is skipped, not counted"""
+        certs_dir = Path(self.temp_dir) / "certs-gone"
+        certs_dir.mkdir()
+        old_time = datetime.now().timestamp() - 40 * 86400
+        for name in ("gone.pdf", "old.pdf"):
+            old_cert = certs_dir / name
+            old_cert.write_bytes(b"x" * 1024 * 1024)
+            os.utime(old_cert, (old_time, old_time))
+        
+        real_unlink = os.unlink
+        def unlink_racing(path):
+            if path.endswith("gone.pdf"):
+                real_unlink(path)  # Someone else removed it first
+            real_unlink(path)
+        
+        with patch.multiple('tasks', CERTIFICATES_DIR=certs_dir,
+                            TEMP_DIR=Path(self.temp_dir) / "missing"), \
+                patch('tasks.os.unlink', side_effect=unlink_racing):
+            stats = tasks.cleanup_old_certificates(days_old=30)
+        
+        self.assertEqual(stats, {'files_removed': 1, 'space_freed_mb': 1.0})
+        self.assertFalse(any(certs_dir.iterdir()))
 
 
-class TestIntegration(unittest.TestCase):
+class TestIntegration(TempDirTestCase):
     """Integration tests"""
     
-    def setUp(self):
-        """Set up integration test fixtures"""
-        self.temp_dir = tempfile.mkdtemp()
-        self.addCleanup(shutil.rmtree, self.temp_dir)
-    
     def test_end_to_end_workflow(self):
         """Test complete certificate generation workflow"""
         # This test would require actual system dependencies
@@ -237,15 +415,21 @@ def run_performance_tests():
     
     # Test QR code generation performance
     import time
+    
+    # Create the output directory once; forked workers inherit ensure_directory's cache
+    qr_dir = Path("temp")
+    utils.ensure_directory(qr_dir)
     start_time = time.time()
     
-    for i in range(100):
-        qr_path = utils.generate_qr_code(f"PERF-TEST-{i:03d}")
-        if qr_path.exists():
-            qr_path.unlink()
+    qr_paths = utils.generate_qr_codes_batch([f"PERF-TEST-{i:03d}" for i in range(100)], qr_dir)
     
     qr_time = time.time() - start_time
-    print(f"✅ QR Code Generation: 100 codes in {qr_time:.2f}s ({qr_time/100*1000:.1f}ms each)")
+    print(f"✅ QR Code Generation: 100 codes in {qr_time:.2f}s ({qr_time/100*1000:.1f}ms each, "
+          f"{os.cpu_count()} processes)")
+    
+    # Remove the generated codes in one pass after timing
+    for qr_path in qr_paths:
+        qr_path.unlink(missing_ok=True)
     
     # Test data validation performance
     start_time = time.time()
@@ -282,3 +466,4 @@ if __name__ == '__main__':
     print("\n" + "=" * 50)
     print("✅ All tests completed!")
     print("💡 To run integration tests: RUN_INTEGRATION_TESTS=1 python test_suite.py")
+    print("💡 To run unit tests in parallel: python -m pytest -n auto test_suite.py")
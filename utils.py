@@ -7,54 +7,135 @@ Description: Utility functions for certificate generation including QR code gene
              and date formatting.
 """
 
-import qrcode
+import os
+import string
+import numpy as np
+import segno
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Union
+from typing import Iterable, List, Optional, Set, Union
 
-def generate_qr_code(certificate_id: str, output_dir: Union[str, Path] = "temp") -> Path:
+# Basic certificate ID validation - adjust based on your requirements
+# Expected format: CERT-XXXXXXXXXXXXXXXX or similar (min 5 characters)
+_CERTIFICATE_ID_CHARS = frozenset(string.ascii_letters + string.digits + "-_")
+
+# Directories already created by ensure_directory in this process
+_ENSURED_DIRS: Set[str] = set()
+
+# English month abbreviations for format_datetime
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def ensure_directory(path: Union[str, Path], refresh: bool = False) -> None:
+    """
+    Create a directory once per process lifetime
+    
+    Args:
+        path: Directory to create if missing
+        refresh: Recreate the directory even if it was already ensured, e.g. after
+            it was removed while the process was running
+    """
+    key = str(path)
+    if refresh or key not in _ENSURED_DIRS:
+        Path(key).mkdir(parents=True, exist_ok=True)
+        _ENSURED_DIRS.add(key)
+
+def _make_qr(certificate_id: str, ecc: str) -> segno.QRCode:
+    """Encode the QR symbol for a certificate ID"""
+    # Add certificate verification URL or just the ID
+    qr_data = f"Certificate ID: {certificate_id}"
+    # You can modify this to include a verification URL:
+    # qr_data = f"https://yoursite.com/verify/{certificate_id}"
+    
+    # Always a full-size QR code (never Micro QR); M is ample for a short ID printed
+    # on a PDF and yields a smaller matrix than H. Don't let segno raise the level.
+    return segno.make_qr(qr_data, error=ecc.lower(), boost_error=False)
+
+def generate_qr_code(certificate_id: str, output_dir: Union[str, Path] = "temp",
+                     ecc: str = "M", box_size: int = 6) -> Path:
     """
     Generate QR code for certificate ID
     
     Args:
         certificate_id: The certificate ID to encode in QR code
         output_dir: Directory to save the QR code image
+        ecc: Error correction level, one of L, M, Q, H
+        box_size: Pixels per QR module
         
     Returns:
         Path to the generated QR code image
     """
     # Ensure output directory exists
     output_path = Path(output_dir)
-    output_path.mkdir(exist_ok=True)
+    ensure_directory(output_path)
+    
+    qr = _make_qr(certificate_id, ecc)
     
-    # Create QR code with optimized settings
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
+    # Save QR code with custom colors; segno writes the PNG itself, no PIL round-trip.
+    # The 2-colour image is already 1 bit per pixel and gets recompressed when embedded
+    # in the PDF, so fast zlib compression costs almost nothing in size.
+    qr_path = output_path / f"{certificate_id}_qr.png"
+    qr.save(
+        str(qr_path),
+        scale=box_size,
         border=4,
+        dark="#2c3e50",  # Dark blue-gray
+        light="white",
+        compresslevel=1
     )
     
-    # Add certificate verification URL or just the ID
-    qr_data = f"Certificate ID: {certificate_id}"
-    # You can modify this to include a verification URL:
-    # qr_data = f"https://yoursite.com/verify/{certificate_id}"
-    
-    qr.add_data(qr_data)
-    qr.make(fit=True)
+    return qr_path
+
+def generate_qr_matrix(certificate_id: str, ecc: str = "M", border: int = 4) -> np.ndarray:
+    """
+    Generate QR code for certificate ID as a module matrix, without an image file
     
-    # Create image with custom colors
-    img = qr.make_image(
-        fill_color="#2c3e50",  # Dark blue-gray
-        back_color="white"
-    )
+    Args:
+        certificate_id: The certificate ID to encode in QR code
+        ecc: Error correction level, one of L, M, Q, H
+        border: Quiet zone width in modules
+        
+    Returns:
+        Square boolean array, True for dark modules, including the border
+    """
+    qr = _make_qr(certificate_id, ecc)
+    return np.pad(np.array(qr.matrix, dtype=bool), border)
+
+@lru_cache(maxsize=1024)
+def parse_iso_datetime(iso_str: str) -> datetime:
+    """
+    Parse ISO datetime string, cached since batches share issue timestamps
     
-    # Save QR code
-    qr_path = output_path / f"{certificate_id}_qr.png"
-    img.save(qr_path)
+    Args:
+        iso_str: ISO format datetime string
+        
+    Returns:
+        Parsed datetime
+        
+    Raises:
+        ValueError: If the string is not in ISO format
+    """
+    return datetime.fromisoformat(iso_str)
+
+def generate_qr_codes_batch(certificate_ids: Iterable[str], output_dir: Union[str, Path] = "temp",
+                            max_workers: Optional[int] = None) -> List[Path]:
+    """
+    Generate QR codes for many certificate IDs in parallel
     
-    return qr_path
+    Args:
+        certificate_ids: Certificate IDs to encode
+        output_dir: Directory to save the QR code images
+        max_workers: Worker processes to use (defaults to the CPU count)
+        
+    Returns:
+        Paths to the generated QR code images, in input order
+    """
+    encode = partial(generate_qr_code, output_dir=output_dir)
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        return list(executor.map(encode, certificate_ids))
 
+@lru_cache(maxsize=1024)
 def format_datetime(iso_str: str) -> str:
     """
     Format ISO datetime string to human-readable format
@@ -66,13 +147,14 @@ def format_datetime(iso_str: str) -> str:
         Formatted date string
     """
     try:
-        dt = datetime.fromisoformat(iso_str)
-        return dt.strftime("%d-%b-%Y %H:%M")
+        dt = parse_iso_datetime(iso_str)
+        # Same output as strftime("%d-%b-%Y %H:%M"), without the locale-aware formatter
+        return f"{dt.day:02d}-{_MONTHS[dt.month - 1]}-{dt.year} {dt.hour:02d}:{dt.minute:02d}"
     except ValueError:
         # Fallback for any parsing issues
         return "Invalid Date"
 
-def validate_certificate_id(certificate_id: str) -> bool:
+def validate_certificate_id(certificate_id: Optional[str]) -> bool:
     """
     Validate certificate ID format
     
@@ -85,10 +167,7 @@ def validate_certificate_id(certificate_id: str) -> bool:
     if not certificate_id or len(certificate_id) < 5:
         return False
     
-    # Basic validation - adjust based on your requirements
-    # Expected format: CERT-XXXXXXXXXXXXXXXX or similar
-    allowed_chars = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_")
-    return all(c in allowed_chars for c in certificate_id.upper())
+    return _CERTIFICATE_ID_CHARS.issuperset(certificate_id)
 
 def get_file_size_mb(file_path: Union[str, Path]) -> float:
     """
@@ -100,12 +179,12 @@ def get_file_size_mb(file_path: Union[str, Path]) -> float:
     Returns:
         File size in MB
     """
-    path = Path(file_path)
-    if path.exists():
-        return path.stat().st_size / (1024 * 1024)
-    return 0.0
+    try:
+        return os.path.getsize(file_path) / 1048576
+    except OSError:
+        return 0.0
 
-def cleanup_temp_files(temp_dir: Union[str, Path] = "temp", max_age_hours: int = 24):
+def cleanup_temp_files(temp_dir: Union[str, Path] = "temp", max_age_hours: int = 24) -> None:
     """
     Clean up temporary files older than specified hours
     
@@ -122,12 +201,19 @@ def cleanup_temp_files(temp_dir: Union[str, Path] = "temp", max_age_hours: int =
     current_time = time.time()
     cutoff_time = current_time - (max_age_hours * 3600)
     
-    for file_path in temp_path.glob("*"):
-        if file_path.is_file() and file_path.stat().st_mtime < cutoff_time:
-            try:
-                file_path.unlink()
-            except OSError:
-                pass  # Ignore files that can't be deleted
+    # DirEntry knows the file type from readdir, so only the mtime costs a stat
+    with os.scandir(temp_path) as entries:
+        stale = [
+            entry.path for entry in entries
+            if entry.is_file(follow_symlinks=False)
+            and entry.stat(follow_symlinks=False).st_mtime < cutoff_time
+        ]
+    
+    for path in stale:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass  # Ignore files that can't be deleted
 
 
 # Additional utility functions can be added here as needed